@@ -8,13 +8,16 @@ Documentación interactiva en:
     http://localhost:8000/docs
 """
 
+import asyncio
+import io
 import os
 import shutil
 import tempfile
 import zipfile
+from collections.abc import Generator, Iterable, Iterator
 from datetime import datetime
 from io import BytesIO
-from typing import List, Optional
+from typing import BinaryIO, List, Optional, Union
 
 import pandas as pd
 from fastapi import FastAPI, File, Form, UploadFile, HTTPException
@@ -78,12 +81,27 @@ def _validar_extension(filename: str, extensiones: tuple, mensaje: str):
         raise HTTPException(status_code=400, detail=mensaje)
 
 
-def _leer_excel(path: str) -> pd.DataFrame:
-    """Lee un archivo Excel y retorna un DataFrame."""
+# python-calamine (Rust) lee Excel bastante más rápido; openpyxl queda como respaldo
+try:
+    import python_calamine  # noqa: F401
+    _EXCEL_ENGINE = "calamine"
+except ImportError:
+    _EXCEL_ENGINE = "openpyxl"
+
+
+def _leer_excel(origen: Union[str, BinaryIO], usecols: Optional[set] = None) -> pd.DataFrame:
+    """Lee un Excel (ruta o archivo en memoria); si se indica usecols, solo esas columnas."""
     try:
         # Leer como texto evita que pandas convierta identificadores a números
         # (por ejemplo, 018373432 -> 18373432).
-        return pd.read_excel(path, dtype=str, keep_default_na=False)
+        return pd.read_excel(
+            origen,
+            engine=_EXCEL_ENGINE,
+            # Filtrar por nombre deja que _validar_columnas informe las faltantes
+            usecols=(lambda col: col in usecols) if usecols else None,
+            dtype=str,
+            keep_default_na=False,
+        )
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error al leer el Excel: {e}")
 
@@ -98,10 +116,72 @@ def _validar_columnas(df: pd.DataFrame, requeridas: set):
         )
 
 
+def _excel_en_memoria(df: pd.DataFrame, sheet_name: str) -> BytesIO:
+    """Escribe el DataFrame a un .xlsx en memoria con xlsxwriter, sin estilos."""
+    output_buffer = BytesIO()
+    # Sin convertir textos a fórmulas ni a URLs: se escriben como texto plano
+    opciones = {"strings_to_formulas": False, "strings_to_urls": False}
+    with pd.ExcelWriter(output_buffer, engine="xlsxwriter", engine_kwargs={"options": opciones}) as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    output_buffer.seek(0)
+    return output_buffer
+
+
 async def _guardar_upload(upload: UploadFile, destino: str):
-    """Guarda un archivo subido en disco."""
+    """Guarda un archivo subido en disco, por bloques de 1 MiB."""
     with open(destino, "wb") as f:
-        f.write(await upload.read())
+        while chunk := await upload.read(1 << 20):
+            f.write(chunk)
+
+
+class _StreamingZipWriter(io.RawIOBase):
+    """Destino no posicionable para zipfile que acumula bytes hasta drenarlos."""
+
+    def __init__(self):
+        super().__init__()
+        self._pendiente = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        self._pendiente.extend(datos)
+        return len(datos)
+
+    def drenar(self) -> bytes:
+        """Devuelve y descarta los bytes escritos desde la última llamada."""
+        datos = bytes(self._pendiente)
+        self._pendiente.clear()
+        return datos
+
+
+def _zip_en_streaming(documentos: Iterable[tuple[str, bytes]]) -> Iterator[bytes]:
+    """
+    Genera el ZIP de (nombre, contenido) por partes, un documento a la vez.
+
+    Al terminar, o si se corta la descarga, cierra documentos (si es un
+    generador) para que libere lo que esté generando sin esperar al recolector.
+    """
+    try:
+        stream = _StreamingZipWriter()
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as zf:
+            for nombre, contenido in documentos:
+                zf.writestr(nombre, contenido)
+                yield stream.drenar()
+        yield stream.drenar()
+    finally:
+        cerrar = getattr(documentos, "close", None)
+        if cerrar is not None:
+            cerrar()
+
+
+def _con_primero(primero, resto: Generator) -> Iterator:
+    """Entrega primero y luego resto; al cerrarse, cierra también resto."""
+    try:
+        yield primero
+        yield from resto
+    finally:
+        resto.close()
 
 
 # ============================================================
@@ -156,50 +236,31 @@ async def generar_razones_endpoint(
     if csv_fechas:
         _validar_extension(csv_fechas.filename, (".csv",), "El archivo de fechas debe ser .csv")
 
-    tmp_dir = tempfile.mkdtemp()
-    output_dir = os.path.join(tmp_dir, "razones_notificacion")
-    os.makedirs(output_dir)
-
-    try:
-        # Guardar archivos
-        excel_path = os.path.join(tmp_dir, "datos.xlsx")
-        plantilla_path = os.path.join(tmp_dir, "plantilla.docx")
-        await _guardar_upload(excel, excel_path)
-        await _guardar_upload(plantilla, plantilla_path)
-
-        # Procesar CSV de fechas (opcional)
-        dic_fechas = None
-        if csv_fechas:
-            csv_path = os.path.join(tmp_dir, "fechas.csv")
-            await _guardar_upload(csv_fechas, csv_path)
-            try:
-                dic_fechas = procesar_csv_fechas(csv_path)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Error al procesar el CSV de fechas: {e}")
-
-        # Leer y validar Excel
-        df = _leer_excel(excel_path)
-        _validar_columnas(df, {"Email", "NOMBRE_CLIENTE", "NUMERO_TITULO", "CUENTA_CONTRATO"})
-
-        # Generar documentos
-        archivos = generar_razones(df, plantilla_path, output_dir, dic_fechas)
-        if not archivos:
-            raise HTTPException(status_code=400, detail="No se generaron documentos. Verifica los datos.")
-
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-            for archivo in archivos:
-                zf.write(archivo, os.path.basename(archivo))
-        zip_buffer.seek(0)
-
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=razones_notificacion.zip"},
-        )
-
-    finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+    # Todo se procesa en memoria: no hace falta pasar los archivos por disco
+    dic_fechas = None
+    if csv_fechas:
+        try:
+            dic_fechas = await asyncio.to_thread(procesar_csv_fechas, BytesIO(await csv_fechas.read()))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error al procesar el CSV de fechas: {e}")
+
+    # Leer y validar Excel
+    columnas = {"Email", "NOMBRE_CLIENTE", "NUMERO_TITULO", "CUENTA_CONTRATO"}
+    df = await asyncio.to_thread(_leer_excel, BytesIO(await excel.read()), columnas)
+    _validar_columnas(df, columnas)
+
+    # Generar documentos (fuera del event loop: es trabajo de CPU). Se generan
+    # a medida que se envía el ZIP; el primero se pide antes para validar.
+    documentos = await asyncio.to_thread(generar_razones, df, await plantilla.read(), dic_fechas)
+    primero = await asyncio.to_thread(next, documentos, None)
+    if primero is None:
+        raise HTTPException(status_code=400, detail="No se generaron documentos. Verifica los datos.")
+
+    return StreamingResponse(
+        _zip_en_streaming(_con_primero(primero, documentos)),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=razones_notificacion.zip"},
+    )
 
 
 # ============================================================
@@ -222,46 +283,33 @@ async def procesar_ordenes_pago_endpoint(
     if not pdfs:
         raise HTTPException(status_code=400, detail="Debe subir al menos un archivo PDF")
 
-    tmp_dir = tempfile.mkdtemp()
+    # Leer Excel en memoria
+    columnas = {"ORDEN DE PAGO INMEDIATO", "Nombre cliente", "Cédula/RUC"}
+    df_base = await asyncio.to_thread(_leer_excel, BytesIO(await excel.read()), columnas)
+    _validar_columnas(df_base, columnas)
 
-    try:
-        # Guardar y leer Excel
-        excel_path = os.path.join(tmp_dir, "base.xlsx")
-        await _guardar_upload(excel, excel_path)
-        df_base = _leer_excel(excel_path)
-        _validar_columnas(df_base, {"ORDEN DE PAGO INMEDIATO", "Nombre cliente", "Cédula/RUC"})
-
-        # Extraer números de los PDFs
-        nombres_pdf = [pdf.filename for pdf in pdfs]
-        registros = extraer_registros_pdfs(nombres_pdf)
-        if not registros:
-            raise HTTPException(
-                status_code=400,
-                detail="No se pudo extraer ningún número de los PDFs. "
-                       "Formato esperado: ORDEN DE PAGO INMEDIATO-XXXXXX-YYYY.pdf",
-            )
-
-        # Cruzar con Excel y generar resultado
-        df_resultado = cruzar_con_excel(df_base, registros)
-        nombre_archivo = generar_nombre_archivo()
-
-        # Generar Excel de salida
-        output_path = os.path.join(tmp_dir, nombre_archivo)
-        df_resultado.to_excel(output_path, index=False, sheet_name="Resultado")
+    # Extraer números de los PDFs
+    nombres_pdf = [pdf.filename for pdf in pdfs]
+    registros = extraer_registros_pdfs(nombres_pdf)
+    if not registros:
+        raise HTTPException(
+            status_code=400,
+            detail="No se pudo extraer ningún número de los PDFs. "
+                   "Formato esperado: ORDEN DE PAGO INMEDIATO-XXXXXX-YYYY.pdf",
+        )
 
-        output_buffer = BytesIO()
-        with open(output_path, "rb") as f:
-            output_buffer.write(f.read())
-        output_buffer.seek(0)
+    # Cruzar con Excel y generar resultado
+    df_resultado = cruzar_con_excel(df_base, registros)
+    nombre_archivo = generar_nombre_archivo()
 
-        return StreamingResponse(
-            output_buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={nombre_archivo}"},
-        )
+    # Generar Excel de salida directamente en memoria
+    output_buffer = await asyncio.to_thread(_excel_en_memoria, df_resultado, "Resultado")
 
-    finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return StreamingResponse(
+        output_buffer,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename={nombre_archivo}"},
+    )
 
 
 # ============================================================
@@ -341,7 +389,7 @@ async def generar_archivos_endpoint(
             raise HTTPException(status_code=400, detail="No se generaron documentos.")
 
         zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_STORED) as zf:
             for archivo in archivos:
                 zf.write(archivo, os.path.basename(archivo))
         zip_buffer.seek(0)
@@ -2,35 +2,198 @@
 documentos.py — Reemplazo de marcadores en documentos Word (.docx)
 """
 
+import re
+import zipfile
+from bisect import bisect_right
+from io import BytesIO
+from itertools import accumulate
+from xml.sax.saxutils import escape
+
 from docx import Document
+from docx.oxml.ns import nsmap
+from lxml import etree
+
 from .docx_utils import iterar_parrafos_docx
 from .formatos import formatear_valor1
 
 
-def reemplazar_en_parrafo(parrafo, reemplazos: dict) -> None:
-    """Reemplaza marcadores [CAMPO] en un párrafo conservando el formato."""
+# Partes del .docx con texto editable (cuerpo, encabezados y pies)
+_PARTE_TEXTO = re.compile(r"word/(document|header\d*|footer\d*)\.xml")
+
+# Elemento w:t del XML crudo: apertura, texto y cierre
+_ELEMENTO_T = re.compile(rb"(<w:t(?:\s[^>]*)?>)([^<]*)(</w:t>)")
+
+# Tabs, saltos de línea y caracteres de control necesitan python-docx (w:tab, w:br, validación)
+_CARACTER_ESPECIAL = re.compile(r"[\x00-\x1f]")
+
+
+def _compilar_reemplazos(reemplazos: dict) -> tuple[re.Pattern | None, dict[str, str]]:
+    """
+    Prepara los reemplazos para aplicarlos en una sola pasada.
+
+    Retorna un patrón con todos los marcadores (None si no hay ninguno) y el
+    texto final de cada marcador.
+    """
+    valores = {}
     for marcador, valor in reemplazos.items():
         marcador_normalizado = str(marcador).strip().strip("[]").upper()
-        valor_texto = formatear_valor1(valor) if marcador_normalizado == "VALOR1" else str(valor)
-
-        if marcador not in parrafo.text:
-            continue
-        # Intentar reemplazar en cada run individual
-        for run in parrafo.runs:
-            if marcador in run.text:
-                run.text = run.text.replace(marcador, valor_texto)
-        # Si el marcador quedó dividido entre runs, unir y reemplazar
-        if marcador in "".join(r.text for r in parrafo.runs):
-            texto_completo = parrafo.text
-            if marcador in texto_completo:
-                texto_nuevo = texto_completo.replace(marcador, valor_texto)
-                if parrafo.runs:
-                    for j in range(len(parrafo.runs) - 1, 0, -1):
-                        parrafo.runs[j].text = ""
-                    parrafo.runs[0].text = texto_nuevo
+        valores[str(marcador)] = formatear_valor1(valor) if marcador_normalizado == "VALOR1" else str(valor)
+
+    marcadores = sorted((m for m in valores if m), key=len, reverse=True)
+    if not marcadores:
+        return None, valores
+    # Los marcadores más largos van primero para que no los tape uno que sea su prefijo
+    return re.compile("|".join(re.escape(m) for m in marcadores)), valores
+
+
+def _reemplazar_compilado(parrafo, patron: re.Pattern, valores: dict[str, str]) -> None:
+    """Aplica en una sola pasada todos los marcadores de patron sobre los runs del párrafo."""
+    runs = parrafo.runs
+    textos = [run.text for run in runs]
+    texto = "".join(textos)
+    coincidencias = list(patron.finditer(texto))
+    if not coincidencias:
+        return
+
+    # Posición inicial de cada run dentro del texto del párrafo
+    inicios = list(accumulate((len(t) for t in textos), initial=0))[:-1]
+    nuevos = list(textos)
+
+    # De atrás hacia adelante, para que las posiciones pendientes sigan siendo válidas
+    for match in reversed(coincidencias):
+        inicio, fin = match.span()
+        primero = bisect_right(inicios, inicio) - 1
+        ultimo = bisect_right(inicios, fin - 1) - 1
+        prefijo = nuevos[primero][: inicio - inicios[primero]]
+        sufijo = nuevos[ultimo][fin - inicios[ultimo]:]
+
+        # Si el marcador quedó dividido entre runs, el valor toma el formato del primero
+        for i in range(primero + 1, ultimo + 1):
+            nuevos[i] = ""
+        nuevos[primero] = prefijo + valores[match.group(0)]
+        nuevos[ultimo] += sufijo
+
+    for run, anterior, nuevo in zip(runs, textos, nuevos):
+        if nuevo != anterior:
+            run.text = nuevo
+
+
+def _parrafos_con_marcadores(doc: Document, marcadores: list[str]) -> set:
+    """
+    Retorna los elementos w:p cuyo texto contiene algún marcador.
+
+    El filtro lo evalúa lxml con XPath, así los párrafos sin marcadores (la
+    mayoría en una plantilla) no pasan por python-docx.
+    """
+    variables = {f"m{i}": marcador for i, marcador in enumerate(marcadores)}
+    condicion = " or ".join(f"contains(string(.), ${nombre})" for nombre in variables)
+    consulta = etree.XPath(f".//w:p[{condicion}]", namespaces={"w": nsmap["w"]})
+
+    raices = [doc.element.body]
+    for section in doc.sections:
+        raices.append(section.header.part.element)
+        raices.append(section.footer.part.element)
+
+    return {p for raiz in raices for p in consulta(raiz, **variables)}
+
+
+def reemplazar_en_parrafo(parrafo, reemplazos: dict) -> None:
+    """Reemplaza marcadores [CAMPO] en un párrafo conservando el formato."""
+    patron, valores = _compilar_reemplazos(reemplazos)
+    if patron is not None:
+        _reemplazar_compilado(parrafo, patron, valores)
 
 
 def reemplazar_en_documento(doc: Document, reemplazos: dict) -> None:
     """Reemplaza marcadores en todo el documento (párrafos, tablas, encabezados, pies)."""
+    patron, valores = _compilar_reemplazos(reemplazos)
+    if patron is None:
+        return
+    objetivos = _parrafos_con_marcadores(doc, [m for m in valores if m])
     for parrafo in iterar_parrafos_docx(doc):
-        reemplazar_en_parrafo(parrafo, reemplazos)
+        if parrafo._p in objetivos:
+            _reemplazar_compilado(parrafo, patron, valores)
+
+
+def admite_reemplazo_xml(plantilla_bytes: bytes, marcadores: list[str]) -> bool:
+    """
+    Indica si los marcadores de la plantilla se pueden reemplazar directo en el XML.
+
+    Es seguro cuando cada marcador aparece completo dentro de un solo w:t, solo
+    en párrafos que también recorre reemplazar_en_documento (cuerpo, tablas,
+    encabezado y pie) y en ningún otro lugar del XML. Así el resultado es el
+    mismo que con python-docx.
+    """
+    # Apariciones en los párrafos que cubre reemplazar_en_documento; se
+    # deduplican por elemento porque los encabezados enlazados se repiten
+    doc = Document(BytesIO(plantilla_bytes))
+    cubiertos = {parrafo._p: parrafo for parrafo in iterar_parrafos_docx(doc)}
+    en_cubiertos = dict.fromkeys(marcadores, 0)
+    for p, parrafo in cubiertos.items():
+        textos = p.xpath("./w:r/w:t/text()")
+        texto_parrafo = "".join(run.text for run in parrafo.runs)
+        for marcador in marcadores:
+            en_textos = sum(t.count(marcador) for t in textos)
+            # Marcador dividido entre runs
+            if en_textos != texto_parrafo.count(marcador):
+                return False
+            en_cubiertos[marcador] += en_textos
+
+    # Todas las apariciones del XML (lo que reescribe reemplazar_en_xml)
+    with zipfile.ZipFile(BytesIO(plantilla_bytes)) as zf:
+        for nombre in zf.namelist():
+            if not _PARTE_TEXTO.fullmatch(nombre):
+                continue
+            xml = zf.read(nombre)
+            textos = etree.fromstring(xml).xpath(".//w:t/text()", namespaces={"w": nsmap["w"]})
+            for marcador in marcadores:
+                en_textos = sum(t.count(marcador) for t in textos)
+                if en_textos != xml.count(escape(marcador).encode()):
+                    return False
+                en_cubiertos[marcador] -= en_textos
+
+    # Cualquier diferencia es un marcador fuera de las zonas cubiertas
+    # (primera página, pares, cuadros de texto, tablas anidadas...)
+    return not any(en_cubiertos.values())
+
+
+def reemplazar_en_xml(plantilla_bytes: bytes, reemplazos: dict) -> bytes | None:
+    """
+    Reemplaza los marcadores directamente en el XML del .docx y retorna el nuevo archivo.
+
+    Solo válido para plantillas aceptadas por admite_reemplazo_xml. Retorna None
+    si algún valor necesita python-docx (tabs, saltos de línea, caracteres de
+    control) o si algún marcador no está en un w:t que se pueda reescribir.
+    """
+    patron, valores = _compilar_reemplazos(reemplazos)
+    if patron is None:
+        return plantilla_bytes
+    if any(_CARACTER_ESPECIAL.search(v) for v in valores.values()):
+        return None
+
+    valores_xml = {escape(m).encode(): escape(v).encode() for m, v in valores.items() if m}
+    patron_xml = re.compile(b"|".join(re.escape(m) for m in sorted(valores_xml, key=len, reverse=True)))
+
+    def _reemplazar_t(match: re.Match) -> bytes:
+        apertura, texto, cierre = match.groups()
+        nuevo = patron_xml.sub(lambda m: valores_xml[m.group(0)], texto)
+        if nuevo == texto:
+            return match.group(0)
+        # Igual que python-docx: conservar espacios al inicio o al final
+        decodificado = nuevo.decode("utf-8")
+        if len(decodificado.strip()) < len(decodificado) and b"xml:space" not in apertura:
+            apertura = apertura[:-1] + b' xml:space="preserve">'
+        return apertura + nuevo + cierre
+
+    salida = BytesIO()
+    with zipfile.ZipFile(BytesIO(plantilla_bytes)) as origen, zipfile.ZipFile(salida, "w") as destino:
+        for info in origen.infolist():
+            datos = origen.read(info)
+            if _PARTE_TEXTO.fullmatch(info.filename):
+                datos = _ELEMENTO_T.sub(_reemplazar_t, datos)
+                # Un marcador fuera de un w:t reconocible queda para python-docx
+                if patron_xml.search(datos):
+                    return None
+            # Se conserva la compresión original de cada parte
+            destino.writestr(info, datos)
+    return salida.getvalue()
@@ -2,6 +2,10 @@
 fechas.py — Procesamiento de CSV de fechas de correo (CPanel)
 """
 
+import re
+from datetime import datetime
+from functools import lru_cache
+
 import pandas as pd
 
 # Mapeo de abreviaciones de meses: español → inglés (para parseo)
@@ -19,12 +23,23 @@ MESES_COMPLETOS = {
     "nov": "noviembre", "dic": "diciembre",
 }
 
+# Abreviación de mes entre espacios; una sola pasada para todos los meses
+_MES_RE = re.compile(rf" ({'|'.join(MESES_ES_EN)}) ", re.IGNORECASE)
+
+# Formato de fecha de CPanel, con el mes ya traducido al inglés
+FORMATO_FECHA_CPANEL = "%d %b %Y %H:%M:%S"
+
 REMITENTE_DEFAULT = "cobranzaypatrocinio@cobypat.com"
 
 
-def procesar_csv_fechas(csv_path: str, remitente: str = REMITENTE_DEFAULT) -> dict:
+def _mes_ingles(match: re.Match) -> str:
+    """Sustitución de _MES_RE: ' feb ' → ' Feb ' (abreviación en inglés)."""
+    return f" {MESES_ES_EN[match.group(1).lower()]} "
+
+
+def procesar_csv_fechas(csv_archivo, remitente: str = REMITENTE_DEFAULT) -> dict:
     """
-    Lee el CSV de CPanel y filtra por remitente.
+    Lee el CSV de CPanel (ruta o archivo en memoria) y filtra por remitente.
 
     Nota:
         Se conservan todas las fechas por destinatario. La selección de las 2
@@ -34,13 +49,11 @@ def procesar_csv_fechas(csv_path: str, remitente: str = REMITENTE_DEFAULT) -> di
     Returns:
         dict: email_destinatario → [lista de fechas]
     """
-    df_csv = pd.read_csv(csv_path)
+    df_csv = pd.read_csv(csv_archivo)
 
     # Parsear fechas (meses en español → inglés)
-    fecha_en = df_csv["Fecha Envío CPanel"].copy()
-    for es, en in MESES_ES_EN.items():
-        fecha_en = fecha_en.str.replace(f" {es} ", f" {en} ", case=False, regex=False)
-    df_csv["_fecha_dt"] = pd.to_datetime(fecha_en, format="%d %b %Y %H:%M:%S")
+    fecha_en = df_csv["Fecha Envío CPanel"].str.replace(_MES_RE, _mes_ingles, regex=True)
+    df_csv["_fecha_dt"] = pd.to_datetime(fecha_en, format=FORMATO_FECHA_CPANEL)
 
     # Filtrar por remitente
     df_filtrado = df_csv[df_csv["Remitente"] == remitente].copy()
@@ -60,22 +73,27 @@ def expandir_mes(texto_fecha: str) -> str:
     Ej: '11 feb 2026 10:30:45' → '11 de febrero de 2026 10:30:45'
     """
     texto = str(texto_fecha).strip()
-    for abrev, completo in MESES_COMPLETOS.items():
-        if f" {abrev} " in texto.lower():
-            partes = texto.split()
-            for i, p in enumerate(partes):
-                if p.lower() == abrev:
-                    partes[i] = f"de {completo} de"
-                    break
-            return " ".join(partes)
-    return texto
+    match = _MES_RE.search(texto)
+    if not match:
+        return texto
+
+    abrev = match.group(1).lower()
+    partes = texto.split()
+    for i, p in enumerate(partes):
+        if p.lower() == abrev:
+            partes[i] = f"de {MESES_COMPLETOS[abrev]} de"
+            break
+    return " ".join(partes)
 
 
+@lru_cache(maxsize=4096)
 def formatear_fechas_notificacion(fecha_notificacion: str) -> str:
     """
     Divide FECHA_NOTIFICACION por ',', agrupa por día, toma los 2 días
     más recientes y de cada día escoge solo la última hora.
     Devuelve texto con meses en nombre completo.
+
+    El resultado se memoiza: varios títulos suelen compartir las mismas fechas.
     """
     if not fecha_notificacion or pd.isna(fecha_notificacion) or str(fecha_notificacion).strip() == "":
         return ""
@@ -85,22 +103,23 @@ def formatear_fechas_notificacion(fecha_notificacion: str) -> str:
     if not raw_partes:
         return ""
 
-    # Parsear cada fecha a datetime para poder agrupar por día y ordenar por hora
+    # Parsear cada fecha a datetime para poder agrupar por día y ordenar por hora.
+    # datetime.strptime evita el costo fijo de pd.to_datetime por cada valor.
+    # El mes se reconoce sin importar mayúsculas ('ene', 'Ene', 'ENE'), igual
+    # que en procesar_csv_fechas.
     fechas_dt = []
     for raw in raw_partes:
-        texto = raw
-        for es, en in MESES_ES_EN.items():
-            texto = texto.replace(f" {es} ", f" {en} ").replace(f" {es.title()} ", f" {en} ")
+        texto = _MES_RE.sub(_mes_ingles, raw)
         try:
-            dt = pd.to_datetime(texto, format="%d %b %Y %H:%M:%S")
+            dt = datetime.strptime(texto, FORMATO_FECHA_CPANEL)
             fechas_dt.append((dt, raw))
-        except Exception:
+        except ValueError:
             # Si no se puede parsear, mantener el texto original
-            fechas_dt.append((pd.NaT, raw))
+            fechas_dt.append((None, raw))
 
     # Filtrar las que se pudieron parsear
-    validas = [(dt, raw) for dt, raw in fechas_dt if pd.notna(dt)]
-    no_validas = [raw for dt, raw in fechas_dt if pd.isna(dt)]
+    validas = [(dt, raw) for dt, raw in fechas_dt if dt is not None]
+    no_validas = [raw for dt, raw in fechas_dt if dt is None]
 
     if not validas:
         # Si ninguna se pudo parsear, devolver las últimas 2 como texto
@@ -5,6 +5,7 @@ con los valores de cada fila de un DataFrame.
 
 import os
 import re
+from io import BytesIO
 from typing import List
 
 import pandas as pd
@@ -277,8 +278,12 @@ def generar_documentos_desde_excel(
     """
     archivos = []
 
+    # Leer la plantilla una sola vez y cargar cada documento desde memoria
+    with open(plantilla_path, "rb") as f:
+        plantilla_bytes = f.read()
+
     for i, row in df.iterrows():
-        doc = Document(plantilla_path)
+        doc = Document(BytesIO(plantilla_bytes))
         variables = {k: _valor_para_placeholder(k, v) for k, v in row.to_dict().items()}
 
         for p in iterar_parrafos_docx(doc):
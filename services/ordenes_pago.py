@@ -2,7 +2,6 @@
 ordenes_pago.py — Procesamiento de órdenes de pago inmediato
 """
 
-import os
 import re
 from datetime import datetime
 
@@ -23,16 +22,14 @@ def extraer_registros_pdfs(nombres_pdf: list[str]) -> list[dict]:
     Returns:
         Lista de dicts con CUENTA_CONTRATO y Attachment.
     """
-    registros = []
-    for nombre in nombres_pdf:
-        nombre_base = os.path.basename(nombre)
-        match = _PATRON_PDF.search(nombre_base)
-        if match:
-            registros.append({
-                "CUENTA_CONTRATO": f"JC-PIC-{match.group(1)}",
-                "Attachment": nombre_base,
-            })
-    return registros
+    nombres_base = pd.Series(nombres_pdf, dtype=object).str.rsplit("/", n=1).str[-1]
+    numeros = nombres_base.str.extract(_PATRON_PDF, expand=False)
+    encontrados = numeros.notna()
+
+    return [
+        {"CUENTA_CONTRATO": f"JC-PIC-{numero}", "Attachment": nombre_base}
+        for numero, nombre_base in zip(numeros[encontrados], nombres_base[encontrados])
+    ]
 
 
 def cruzar_con_excel(df_base: pd.DataFrame, registros: list[dict]) -> pd.DataFrame:
@@ -48,26 +45,22 @@ def cruzar_con_excel(df_base: pd.DataFrame, registros: list[dict]) -> pd.DataFra
         DataFrame con columnas: Email, NOMBRE_CLIENTE, NUMERO_TITULO,
         CUENTA_CONTRATO, Attachment.
     """
-    df_pdfs = pd.DataFrame(registros)
-
-    # Asegurar tipos string para el merge
-    df_base["ORDEN DE PAGO INMEDIATO"] = df_base["ORDEN DE PAGO INMEDIATO"].astype(str).str.strip()
+    df_pdfs = pd.DataFrame(registros, columns=["CUENTA_CONTRATO", "Attachment"])
     df_pdfs["CUENTA_CONTRATO"] = df_pdfs["CUENTA_CONTRATO"].astype(str).str.strip()
 
-    # Merge
-    df_merged = df_pdfs.merge(
-        df_base[["ORDEN DE PAGO INMEDIATO", "Nombre cliente", "Cédula/RUC"]],
-        left_on="CUENTA_CONTRATO",
-        right_on="ORDEN DE PAGO INMEDIATO",
-        how="left",
+    # Indexar la base por orden de pago y cruzar contra el índice; como el
+    # merge, una orden repetida en la base genera una fila por coincidencia
+    base = df_base[["Nombre cliente", "Cédula/RUC"]].set_index(
+        df_base["ORDEN DE PAGO INMEDIATO"].astype(str).str.strip()
     )
+    df_cruce = df_pdfs.join(base, on="CUENTA_CONTRATO", how="left").reset_index(drop=True)
 
     return pd.DataFrame({
         "Email": "",
-        "NOMBRE_CLIENTE": df_merged["Nombre cliente"],
-        "NUMERO_TITULO": df_merged["Cédula/RUC"],
-        "CUENTA_CONTRATO": df_merged["CUENTA_CONTRATO"].str.replace("JC-PIC-", "", regex=False),
-        "Attachment": df_merged["Attachment"],
+        "NOMBRE_CLIENTE": df_cruce["Nombre cliente"],
+        "NUMERO_TITULO": df_cruce["Cédula/RUC"],
+        "CUENTA_CONTRATO": df_cruce["CUENTA_CONTRATO"].str.replace("JC-PIC-", "", regex=False),
+        "Attachment": df_cruce["Attachment"],
     })
 
 
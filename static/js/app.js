@@ -53,8 +53,6 @@ form.addEventListener('submit', async (e) => {
             body: formData,
         });
 
-        const elapsed = ((Date.now() - startTime) / 1000).toFixed(1);
-
         if (!response.ok) {
             let errorMsg = 'Error desconocido';
             try {
@@ -67,7 +65,9 @@ form.addEventListener('submit', async (e) => {
             return;
         }
 
+        // El ZIP se genera mientras se descarga: medir al recibirlo completo
         const blob = await response.blob();
+        const elapsed = ((Date.now() - startTime) / 1000).toFixed(1);
         const sizeKB = (blob.size / 1024).toFixed(0);
 
         downloadBlob(blob, 'razones_notificacion.zip');